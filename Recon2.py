@@ -15,10 +15,11 @@ import shutil
 from io import BytesIO
 import requests
 import uuid
-from rename import process_rename_mode
+from rename import process_rename_mode, ORDER_OPTIONS
 from convers import process_convert_mode
 from water import process_watermark_mode
 from utils import filter_large_files, SUPPORTED_EXTS, MAX_SIZE_MB
+from joblog import JobLog, discard_job_log, render_log_viewer
 
 # Универсальный ресемплинг для предпросмотра
 from PIL import Image
@@ -111,7 +112,7 @@ with st.expander("ℹ️ Инструкция и ответы на вопрос
 if "reset_uploader" not in st.session_state:
     st.session_state["reset_uploader"] = 0
 if "log" not in st.session_state:
-    st.session_state["log"] = []
+    st.session_state["log"] = None
 if "result_zip" not in st.session_state:
     st.session_state["result_zip"] = None
 if "stats" not in st.session_state:
@@ -121,7 +122,7 @@ if "mode" not in st.session_state:
 
 def reset_all():
     st.session_state["reset_uploader"] += 1
-    st.session_state["log"] = []
+    discard_job_log(st.session_state)
     st.session_state["result_zip"] = None
     st.session_state["stats"] = {}
     st.session_state["mode"] = "Переименование фото"
@@ -131,7 +132,7 @@ mode = st.radio(
     ["Переименование фото", "Конвертация в JPG", "Водяной знак"],
     index=0 if st.session_state["mode"] == "Переименование фото" else (1 if st.session_state["mode"] == "Конвертация в JPG" else 2),
     key="mode_radio",
-    on_change=lambda: st.session_state.update({"log": [], "result_zip": None, "stats": {}})
+    on_change=lambda: (discard_job_log(st.session_state), st.session_state.update({"result_zip": None, "stats": {}}))
 )
 st.session_state["mode"] = mode
 
@@ -153,7 +154,7 @@ uploaded_files = st.file_uploader(
 if mode == "Водяной знак":
     st.markdown("**Выберите водяной знак (PNG/JPG):**")
     import glob
-    from water import apply_watermark
+    from imaging import apply_watermark
     watermark_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "watermarks"))
     preset_files = []
     if os.path.exists(watermark_dir):
@@ -183,6 +184,10 @@ if mode == "Водяной знак":
         'Левый верхний угол': 'top_left',
         'По центру': 'center',
     }
+    st.sidebar.markdown("**Текстовый водяной знак** (если не выбран PNG/JPG):")
+    wm_text = st.sidebar.text_input("Текст (название студии, номер заказа)", "").strip() or None
+    text_color = st.sidebar.color_picker("Цвет текста", "#FFFFFF")
+    text_options = {"color": tuple(int(text_color[i:i + 2], 16) for i in (1, 3, 5))}
     bg_color = st.sidebar.color_picker("Цвет фона предпросмотра", "#CCCCCC")
 
     # --- Предпросмотр водяного знака ---
@@ -221,14 +226,25 @@ if mode == "Водяной знак":
         with open(wm_path, "wb") as f:
             f.write(user_wm_file.getvalue() if hasattr(user_wm_file, 'getvalue') else user_wm_file.read())
     try:
-        if wm_path:
-            preview = apply_watermark(preview_img, watermark_path=wm_path, position=pos_map[position], opacity=opacity, scale=size_percent/100.0)
+        if wm_path or wm_text:
+            preview = apply_watermark(preview_img, watermark_path=wm_path, text=wm_text, position=pos_map[position], opacity=opacity, scale=size_percent/100.0, text_options=text_options)
         else:
             preview = preview_img
         st.image(preview, caption="Предпросмотр", use_container_width=True)
     except Exception as e:
         st.warning(f"Ошибка предпросмотра: {e}")
 
+# --- Порядок нумерации для режима Переименование ---
+rename_order = None
+if mode == "Переименование фото":
+    st.sidebar.header('Порядок нумерации')
+    order_label = st.sidebar.selectbox(
+        'Нумеровать файлы',
+        list(ORDER_OPTIONS),
+        help="Дата съёмки и камера читаются из EXIF без декодирования изображений."
+    )
+    rename_order = ORDER_OPTIONS[order_label]
+
 # Масштаб JPG для всех режимов
 st.sidebar.markdown("**Масштаб JPG (разрешение):**")
 scale_percent = st.sidebar.slider(
@@ -273,11 +289,11 @@ if uploaded_files:
         st.sidebar.warning(f"Не удалось рассчитать размер: {e}")
 
 if mode == "Переименование фото":
-    process_rename_mode(uploaded_files, scale_percent)
+    process_rename_mode(uploaded_files, scale_percent, order=rename_order)
 elif mode == "Конвертация в JPG":
     process_convert_mode(uploaded_files, scale_percent)
 elif mode == "Водяной знак":
-    process_watermark_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position, scale_percent)
+    process_watermark_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position, scale_percent, wm_text=wm_text, text_options=text_options)
 
 # Универсальный блок скачивания архива и лога для всех режимов
 if st.session_state.get("result_zip"):
@@ -308,17 +324,24 @@ if st.session_state.get("result_zip"):
         )
         if archive_size:
             st.caption(f"Размер архива: {archive_size // 1024} КБ ({archive_size / 1024 / 1024:.2f} МБ)")
-    with st.expander("Показать лог обработки", expanded=False):
-        st.download_button(
-            label="📄 Скачать лог в .txt",
-            data="\n".join(st.session_state["log"]),
-            file_name="log.txt",
-            mime="text/plain"
-        )
-        st.text_area("Лог:", value="\n".join(st.session_state["log"]), height=300, disabled=True)
 else:
     st.info("ℹ️ Архив пока не создан. Загрузите изображения и нажмите кнопку обработки.")
 
+# Лог задания: файл на диске, в интерфейсе — постранично
+job_log = st.session_state.get("log")
+if isinstance(job_log, JobLog) and job_log.count > 0 and os.path.exists(job_log.path):
+    with st.expander("Показать лог обработки", expanded=False):
+        # Файл лога читается в память только по запросу, а не при каждом перезапуске скрипта
+        if st.button("📄 Подготовить лог к скачиванию", key="prepare_log_download"):
+            with job_log.open_text() as log_file:
+                st.download_button(
+                    label="📄 Скачать лог в .txt",
+                    data=log_file,
+                    file_name="log.txt",
+                    mime="text/plain"
+                )
+        render_log_viewer(job_log, st)
+
 if st.button("🔄 Начать сначала", type="primary"):
     reset_all()
     st.rerun()
@@ -0,0 +1,87 @@
+# archive.py
+import tempfile
+import zipfile
+from pathlib import PurePosixPath
+
+# Уже сжатые форматы: повторное сжатие deflate только тратит CPU
+STORED_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.heic', '.heif', '.zip')
+# Архив до этого размера собирается в памяти, больший уходит во временный файл
+SPOOL_BYTES = 16 * 1024 * 1024
+
+
+def _compress_type(arcname):
+    return zipfile.ZIP_STORED if str(arcname).lower().endswith(STORED_EXTS) else zipfile.ZIP_DEFLATED
+
+
+def _normalize(arcname):
+    return PurePosixPath(*PurePosixPath(str(arcname).replace("\\", "/")).parts).as_posix()
+
+
+class ArchiveSink:
+    """
+    ZIP-архив результата, в который изображения кодируются прямо из памяти,
+    без промежуточных файлов рядом с исходниками.
+    По умолчанию архив собирается в SpooledTemporaryFile: небольшой остаётся в памяти,
+    крупный пишется на диск, и в session_state попадает единственная копия (getvalue).
+    """
+
+    def __init__(self, target=None):
+        self.spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) if target is None else None
+        self.zipf = zipfile.ZipFile(target if target is not None else self.spool, "w")
+        self.names = set()
+        self.count = 0
+
+    def _reserve(self, arcname, unique):
+        name = _normalize(arcname)
+        if name in self.names:
+            if not unique:
+                return None
+            path = PurePosixPath(name)
+            n = 2
+            while True:
+                name = path.with_name(f"{path.stem}_{n}{path.suffix}").as_posix()
+                if name not in self.names:
+                    break
+                n += 1
+        self.names.add(name)
+        return name
+
+    def add_bytes(self, data, arcname, unique=False):
+        """
+        Добавляет готовые байты. Возвращает имя записи в архиве или None, если такое имя уже есть.
+        unique=True — при совпадении имя получает суффикс _2, _3…, и файл не теряется.
+        """
+        name = self._reserve(arcname, unique)
+        if name is None:
+            return None
+        self.zipf.writestr(name, data, compress_type=_compress_type(name))
+        self.count += 1
+        return name
+
+    def add_file(self, path, arcname, unique=False):
+        """Копирует файл с диска как есть (без перекодирования). Возвращает имя как add_bytes."""
+        name = self._reserve(arcname, unique)
+        if name is None:
+            return None
+        self.zipf.write(path, arcname=name, compress_type=_compress_type(name))
+        self.count += 1
+        return name
+
+    def close(self):
+        self.zipf.close()
+
+    def getvalue(self):
+        """
+        Байты архива (только без своего target; вызывать один раз, после close).
+        Буфер сразу освобождается, чтобы в памяти не оставалось второй копии.
+        """
+        self.spool.seek(0)
+        data = self.spool.read()
+        self.spool.close()
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
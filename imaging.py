@@ -0,0 +1,173 @@
+# imaging.py
+# Обработка изображений без интерфейса: общая для режимов Streamlit, watch-режима и воркеров очереди.
+# Здесь нет импортов streamlit, поэтому воркеры и watch.py работают без UI-зависимостей.
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+
+RESAMPLING = getattr(getattr(Image, 'Resampling', Image), 'LANCZOS', getattr(Image, 'LANCZOS', getattr(Image, 'NEAREST', 0)))
+
+# Шрифт с кириллицей, если не указан свой; ищется в системных папках шрифтов
+DEFAULT_FONT = "DejaVuSans.ttf"
+TEXT_MEASURE_SIZE = 100
+MIN_FONT_SIZE = 10
+# Предел памяти под готовые текстовые слои: кэш общий для всех сессий процесса
+TEXT_CACHE_BYTES = 32 * 1024 * 1024
+
+def _load_font(font_path, font_size):
+    for path in (font_path, DEFAULT_FONT):
+        if path:
+            try:
+                return ImageFont.truetype(path, font_size)
+            except OSError:
+                continue
+    try:
+        return ImageFont.load_default(font_size)
+    except TypeError:
+        # Pillow < 10.1: встроенный шрифт не масштабируется
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=32)
+def _text_width_ratio(text, font_path):
+    """Ширина текста на единицу кегля — чтобы подобрать размер шрифта без повторных замеров."""
+    font = _load_font(font_path, TEXT_MEASURE_SIZE)
+    left, _, right, _ = font.getbbox(text)
+    return max(right - left, 1) / TEXT_MEASURE_SIZE
+
+class _TextLayerCache:
+    """LRU-кэш текстовых слоёв с пределом по байтам, а не по числу записей."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.layers = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        with self.lock:
+            layer = self.layers.get(key)
+            if layer is not None:
+                self.layers.move_to_end(key)
+                return layer
+        layer = render(*key)
+        size = layer.width * layer.height * 4
+        if size > self.max_bytes:
+            return layer
+        with self.lock:
+            if key not in self.layers:
+                self.layers[key] = layer
+                self.nbytes += size
+                while self.nbytes > self.max_bytes:
+                    _, old = self.layers.popitem(last=False)
+                    self.nbytes -= old.width * old.height * 4
+        return layer
+
+_text_layers = _TextLayerCache(TEXT_CACHE_BYTES)
+
+def _render_text_layer(text, font_path, font_size, color, opacity):
+    """
+    Готовый RGBA-слой с текстом. Кэшируется по (текст, шрифт, кегль, цвет, прозрачность):
+    в пакете из тысяч кадров одной ширины текст растеризуется один раз.
+    Слой из кэша нельзя изменять — он общий для всех вызовов.
+    """
+    font = _load_font(font_path, font_size)
+    left, top, right, bottom = font.getbbox(text)
+    wm = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(wm)
+    # Альфа-канал цвета для прозрачности
+    draw.text((-left, -top), text, font=font, fill=color[:3] + (int(255 * opacity),))
+    return wm
+
+def apply_watermark(
+    base_image: Image.Image,
+    watermark_path: str = None,
+    position: str = "bottom_right",
+    opacity: float = 0.5,
+    scale: float = 0.2,
+    text: str = None,
+    text_options: dict = None,
+) -> Image.Image:
+    """
+    Накладывает водяной знак (PNG или текст) на изображение.
+    :param base_image: Исходное изображение (PIL.Image)
+    :param watermark_path: Путь к PNG-водяном знаку (или BytesIO, или None)
+    :param position: Позиция ('top_left', 'top_right', 'center', 'bottom_left', 'bottom_right')
+    :param opacity: Прозрачность (0.0-1.0)
+    :param scale: Масштаб водяного знака относительно ширины base_image (0.0-1.0)
+    :param text: Текст для текстового водяного знака (или None)
+    :param text_options: dict с параметрами текста (font_path, color); кегль подбирается по scale
+    :return: Новое изображение с водяным знаком
+    """
+    assert watermark_path or text, "Нужно указать watermark_path или text"
+    img = base_image.convert("RGBA")
+    wm = None
+    if watermark_path:
+        # Поддержка BytesIO
+        if isinstance(watermark_path, BytesIO):
+            wm = Image.open(watermark_path).convert("RGBA")
+        else:
+            wm = Image.open(watermark_path).convert("RGBA")
+        # Масштабирование
+        wm_width = int(img.width * scale)
+        wm_ratio = wm_width / wm.width
+        wm_height = int(wm.height * wm_ratio)
+        wm = wm.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
+        # Применение прозрачности
+        if opacity < 1.0:
+            alpha = wm.getchannel("A").point(lambda p: int(p * opacity))
+            wm.putalpha(alpha)
+    elif text:
+        opts = text_options or {}
+        font_path = opts.get("font_path", None)
+        color = tuple(opts.get("color", (255, 255, 255)))
+        # Кегль подбирается так, чтобы текст занял scale ширины фото
+        font_size_scaled = max(MIN_FONT_SIZE, int(img.width * scale / _text_width_ratio(text, font_path)))
+        wm = _text_layers.get((text, font_path, font_size_scaled, color, opacity), _render_text_layer)
+    else:
+        raise ValueError("Не указан водяной знак")
+    # Позиционирование
+    positions = {
+        "top_left": (0, 0),
+        "top_right": (img.width - wm.width, 0),
+        "center": ((img.width - wm.width) // 2, (img.height - wm.height) // 2),
+        "bottom_left": (0, img.height - wm.height),
+        "bottom_right": (img.width - wm.width, img.height - wm.height),
+    }
+    pos = positions.get(position, positions["bottom_right"])
+    # Вставка водяного знака
+    out = img.copy()
+    out.alpha_composite(wm, dest=pos)
+    return out.convert("RGB")
+
+def watermark_image(img, watermark_path, position="bottom_right", opacity=0.5, scale=0.2, scale_percent=100, text=None, text_options=None):
+    """Водяной знак + масштабирование результата, как в режиме «Водяной знак»."""
+    processed_img = apply_watermark(
+        img,
+        watermark_path=watermark_path,
+        text=text,
+        position=position,
+        opacity=opacity,
+        scale=scale,
+        text_options=text_options
+    )
+    # resize если нужно
+    if scale_percent != 100:
+        w, h = processed_img.size
+        new_w = max(1, int(w * scale_percent / 100))
+        new_h = max(1, int(h * scale_percent / 100))
+        processed_img = processed_img.resize((new_w, new_h), Image.LANCZOS)
+    return processed_img
+
+
+def convert_image(img, scale_percent=100):
+    """Приводит изображение к RGB и масштабирует. ICC-профиль нужно взять из img.info до вызова."""
+    img = img.convert("RGB")
+    # Изменение разрешения
+    if scale_percent != 100:
+        w, h = img.size
+        new_w = max(1, int(w * scale_percent / 100))
+        new_h = max(1, int(h * scale_percent / 100))
+        img = img.resize((new_w, new_h), RESAMPLING)
+    return img
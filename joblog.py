@@ -0,0 +1,167 @@
+# joblog.py
+import os
+import time
+import uuid
+import tempfile
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+LOG_DIR = os.path.join(tempfile.gettempdir(), "photoflow_logs")
+RECENT_LIMIT = 200
+PAGE_SIZE = 100
+# Логи брошенных сессий старше этого срока удаляются при создании нового задания
+LOG_MAX_AGE = 24 * 3600
+
+LEVEL_INFO = "INFO"
+LEVEL_ERROR = "ERROR"
+
+
+def _cleanup_stale_logs(max_age=LOG_MAX_AGE):
+    now = time.time()
+    try:
+        names = os.listdir(LOG_DIR)
+    except OSError:
+        return
+    for name in names:
+        if not name.endswith(".log"):
+            continue
+        path = os.path.join(LOG_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class JobLog:
+    """
+    Лог задания: каждая запись сразу пишется в файл задания,
+    в памяти хранятся только последние RECENT_LIMIT записей и счётчики.
+    Поддерживает log.append("...") как обычный список; ошибки пишутся через log.error("...").
+    """
+
+    def __init__(self, job_id=None, recent_limit=RECENT_LIMIT):
+        self.job_id = job_id or uuid.uuid4().hex
+        os.makedirs(LOG_DIR, exist_ok=True)
+        _cleanup_stale_logs()
+        self.path = os.path.join(LOG_DIR, f"{self.job_id}.log")
+        self.recent = deque(maxlen=recent_limit)
+        self.count = 0
+        self.error_count = 0
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def append(self, message, level=LEVEL_INFO):
+        # Одна запись — одна строка файла
+        message = str(message).replace("\n", " ")
+        record = {
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "level": level,
+            "message": message,
+        }
+        self.recent.append(record)
+        self.count += 1
+        if level == LEVEL_ERROR:
+            self.error_count += 1
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(f"{record['time']}\t{level}\t{message}\n")
+
+    def error(self, message):
+        self.append(message, level=LEVEL_ERROR)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def delete(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return self.count
+
+    def iter_records(self, errors_only=False):
+        """Читает записи из файла построчно, не загружая весь лог в память."""
+        self.flush()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t", 2)
+                if len(parts) != 3:
+                    continue
+                record = {"time": parts[0], "level": parts[1], "message": parts[2]}
+                if errors_only and record["level"] != LEVEL_ERROR:
+                    continue
+                yield record
+
+    def page(self, page_num, page_size=PAGE_SIZE, errors_only=False):
+        start = page_num * page_size
+        return list(islice(self.iter_records(errors_only), start, start + page_size))
+
+    def total(self, errors_only=False):
+        return self.error_count if errors_only else self.count
+
+    def open_text(self):
+        """Файл лога для st.download_button / zipf.write без склейки строк в памяти."""
+        self.flush()
+        return open(self.path, "rb")
+
+
+def recent_text(job_log):
+    """Последние записи из кольцевого буфера — без чтения файла."""
+    return "\n".join(format_record(r) for r in job_log.recent)
+
+
+def store_job_log(session_state, job_log):
+    """Закрывает лог задания и кладёт его в session_state, удаляя файл предыдущего."""
+    job_log.close()
+    discard_job_log(session_state)
+    session_state["log"] = job_log
+
+
+def discard_job_log(session_state):
+    old = session_state.get("log")
+    if isinstance(old, JobLog):
+        old.delete()
+    session_state["log"] = None
+
+
+def format_record(record):
+    return f"[{record['time']}] {record['message']}"
+
+
+def render_log_viewer(job_log, st, key="log_viewer"):
+    """Постраничный просмотр лога с фильтром «только ошибки»."""
+    if not isinstance(job_log, JobLog) or job_log.count == 0:
+        st.caption("Лог пуст.")
+        return
+    errors_only = st.checkbox(f"Только ошибки ({job_log.error_count})", key=f"{key}_errors")
+    total = job_log.total(errors_only)
+    pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    page_num = 0
+    if pages > 1:
+        page_num = st.number_input(
+            f"Страница (всего {pages})",
+            min_value=1, max_value=pages, value=1, step=1,
+            key=f"{key}_page_{job_log.job_id}_{errors_only}"
+        ) - 1
+    records = job_log.page(page_num, errors_only=errors_only)
+    if records:
+        st.caption(f"Записей: {total}. Показаны {page_num * PAGE_SIZE + 1}–{page_num * PAGE_SIZE + len(records)}.")
+    else:
+        st.caption("Нет записей.")
+    # У виджета с ключом Streamlit игнорирует новое value, поэтому ключ меняется вместе с содержимым
+    st.text_area(
+        "Лог:", value="\n".join(format_record(r) for r in records), height=300, disabled=True,
+        key=f"{key}_text_{job_log.job_id}_{page_num}_{errors_only}"
+    )
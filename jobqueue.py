@@ -0,0 +1,272 @@
+# jobqueue.py
+# Очередь заданий в общей папке (SQLite + файлы), чтобы пиксельную работу делали отдельные процессы-воркеры.
+#
+# Структура папки очереди:
+#   queue.db               — задания и задачи (по одной на изображение)
+#   jobs/<job_id>/in/...   — входные файлы задания
+#   jobs/<job_id>/out/...  — результаты воркеров (по файлу на задачу, имя в архиве — в tasks.rel)
+# Все пути в базе хранятся относительно папки очереди, поэтому на разных узлах её можно
+# монтировать в разные места. Журнал SQLite — обычный (не WAL): WAL не работает на сетевых ФС.
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+QUEUE_ENV = "PHOTOFLOW_QUEUE_DIR"
+DB_NAME = "queue.db"
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 0.5
+# Если за это время не завершилась ни одна задача, веб-процесс перестаёт ждать воркеров
+STALL_TIMEOUT = 600
+# Задание короче этого (по оценке probe.plan_job) быстрее обработать на месте,
+# чем копировать в очередь и ждать воркеров
+DISTRIBUTE_MIN_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    src TEXT NOT NULL,
+    dst TEXT NOT NULL,
+    rel TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_until);
+CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id);
+"""
+
+
+class JobQueue:
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+        os.makedirs(self.root / "jobs", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.root / DB_NAME), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def path(self, rel):
+        """Абсолютный путь для пути из базы."""
+        return self.root / rel
+
+    def submit_job(self, settings, items):
+        """
+        Копирует входные файлы в папку очереди и ставит по задаче на каждый.
+        items: список (исходник, относительный путь результата в архиве); исходник — путь
+        или объект с методом open() (pipeline.Source).
+        Водяной знак из settings["watermark_path"] тоже копируется в задание.
+        Возвращает id задания.
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = Path("jobs") / job_id
+        os.makedirs(self.root / job_dir / "in", exist_ok=True)
+        settings = dict(settings)
+        if settings.get("watermark_path"):
+            wm_rel = job_dir / ("watermark" + Path(settings["watermark_path"]).suffix.lower())
+            shutil.copyfile(settings["watermark_path"], self.root / wm_rel)
+            settings["watermark_path"] = str(wm_rel)
+        rows = []
+        try:
+            for i, (src, rel) in enumerate(items):
+                # Номер в именах входа и выхода — чтобы одинаковые имена (папки, a.png и a.jpg)
+                # не перезаписали друг друга
+                # У Path тоже есть open(), поэтому путь отличаем по типу, а не по наличию метода
+                is_path = isinstance(src, (str, os.PathLike))
+                suffix = (Path(src) if is_path else src.rel_path).suffix.lower()
+                src_rel = job_dir / "in" / f"{i}{suffix}"
+                if is_path:
+                    shutil.copyfile(src, self.root / src_rel)
+                else:
+                    with src.open() as fin, open(self.root / src_rel, "wb") as fout:
+                        shutil.copyfileobj(fin, fout)
+                rows.append((job_id, str(src_rel), str(job_dir / "out" / f"{i}.jpg"), str(rel)))
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT INTO jobs (id, settings, created) VALUES (?, ?, ?)",
+                             (job_id, json.dumps(settings, ensure_ascii=False), time.time()))
+                conn.executemany("INSERT INTO tasks (job_id, src, dst, rel) VALUES (?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        except BaseException:
+            # Копирование прервано (в том числе перезапуском скрипта Streamlit) — не оставляем файлы в папке очереди
+            shutil.rmtree(self.root / job_dir, ignore_errors=True)
+            raise
+        return job_id
+
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        Забирает одну задачу в аренду: новую или с истёкшей арендой.
+        Возвращает dict задачи с настройками задания или None, если очередь пуста.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Воркер умер на задаче MAX_ATTEMPTS раз — больше не выдаём её
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', error = 'аренда истекла' "
+                "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                "SELECT t.*, j.settings FROM tasks t JOIN jobs j ON j.id = t.job_id "
+                "WHERE t.status = 'queued' OR (t.status = 'leased' AND t.lease_until < ?) "
+                "ORDER BY t.id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now + lease_seconds, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        task = dict(row)
+        task["settings"] = json.loads(task["settings"])
+        task["attempts"] += 1
+        return task
+
+    def _finish(self, task_id, worker_id, status, error=None):
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET status = ?, error = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, error, task_id, worker_id)
+            )
+            # 0 строк — аренду уже забрал другой воркер, результат этого игнорируется
+            return cur.rowcount == 1
+
+    def renew(self, task_id, worker_id, lease_seconds=LEASE_SECONDS):
+        """Продлевает аренду задачи. False — аренда уже потеряна."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_seconds, task_id, worker_id)
+            )
+            return cur.rowcount == 1
+
+    def complete(self, task_id, worker_id):
+        return self._finish(task_id, worker_id, "done")
+
+    def fail(self, task_id, worker_id, error, attempts, permanent=False):
+        """permanent=True — ошибка повторится при любой попытке, задача сразу помечается failed."""
+        status = "failed" if permanent or attempts >= MAX_ATTEMPTS else "queued"
+        return self._finish(task_id, worker_id, status, error)
+
+    def job_status(self, job_id):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM tasks WHERE job_id = ? GROUP BY status", (job_id,)).fetchall()
+        status = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        status.update({row["status"]: row["n"] for row in rows})
+        status["total"] = sum(status.values())
+        return status
+
+    def job_tasks(self, job_id):
+        with closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute("SELECT * FROM tasks WHERE job_id = ? ORDER BY id", (job_id,))]
+
+    def cancel_job(self, job_id):
+        """Снимает незавершённые задачи, чтобы воркеры их не брали."""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE tasks SET status = 'failed', error = 'задание отменено' "
+                         "WHERE job_id = ? AND status IN ('queued', 'leased')", (job_id,))
+
+    def delete_job(self, job_id):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM tasks WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        shutil.rmtree(self.root / "jobs" / job_id, ignore_errors=True)
+
+    def discard_orphan(self, task):
+        """
+        Воркер дописал результат задачи, задание которой уже удалено, и тем самым
+        заново создал папку задания — убираем её.
+        """
+        with closing(self._connect()) as conn:
+            exists = conn.execute("SELECT 1 FROM jobs WHERE id = ?", (task["job_id"],)).fetchone()
+        if exists is None:
+            shutil.rmtree(self.root / "jobs" / task["job_id"], ignore_errors=True)
+
+
+def get_queue(plan=None):
+    """
+    Очередь из переменной окружения PHOTOFLOW_QUEUE_DIR или None — тогда обработка локальная.
+    С планом задания (probe.plan_job) короткие задания тоже обрабатываются локально.
+    """
+    queue_dir = os.environ.get(QUEUE_ENV)
+    if not queue_dir:
+        return None
+    if plan is not None and plan["est_seconds"] < DISTRIBUTE_MIN_SECONDS:
+        return None
+    return JobQueue(queue_dir)
+
+
+def run_distributed(queue, settings, sources, progress, log, add_result, poll_interval=POLL_INTERVAL, stall_timeout=STALL_TIMEOUT):
+    """
+    Отправляет изображения (pipeline.Source) в очередь и ждёт воркеров.
+    add_result(путь результата, относительный путь) вызывается для каждой готовой задачи —
+    например, чтобы скопировать результат в архив.
+    Возвращает ([значения add_result], число ошибок). Задание удаляется из очереди в любом случае,
+    в том числе если скрипт прерван во время ожидания.
+    """
+    items = [(src, src.rel_path.with_suffix('.jpg')) for src in sources]
+    job_id = queue.submit_job(settings, items)
+    log.append(f"📤 Задание {job_id}: {len(items)} файлов отправлено в очередь {queue.root}")
+    try:
+        reported = 0
+        last_change = time.monotonic()
+        while True:
+            status = queue.job_status(job_id)
+            finished = status["done"] + status["failed"]
+            if finished > reported:
+                progress.update(finished - reported)
+                reported = finished
+                last_change = time.monotonic()
+            if finished >= status["total"]:
+                break
+            if time.monotonic() - last_change > stall_timeout:
+                log.error(f"❌ Задание {job_id}: воркеры не отвечают {stall_timeout} сек, ожидание прервано")
+                break
+            time.sleep(poll_interval)
+        results = []
+        errors = 0
+        for task in queue.job_tasks(job_id):
+            if task["status"] == "done":
+                results.append(add_result(str(queue.path(task["dst"])), Path(task["rel"])))
+                log.append(f"✅ {task['rel']} (воркер {task['worker']})")
+            else:
+                errors += 1
+                log.error(f"❌ {task['rel']}: ошибка обработки ({task['error'] or 'не обработан'})")
+        return results, errors
+    finally:
+        # Незавершённые задачи снимаются, чтобы воркеры не обрабатывали то, что никто не заберёт
+        queue.cancel_job(job_id)
+        queue.delete_job(job_id)
@@ -0,0 +1,81 @@
+# metadata.py
+# Индекс EXIF-метаданных для порядка нумерации в режиме переименования.
+# Читаются только заголовки (Image.open ленивый), пиксели не декодируются.
+import re
+from PIL import Image
+
+TAG_MAKE = 271
+TAG_MODEL = 272
+TAG_DATETIME = 306
+EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 36867
+TAG_SUBSEC_ORIGINAL = 37521
+TAG_BODY_SERIAL = 42033
+
+ORDER_NAME = "name"
+ORDER_NATURAL = "natural"
+ORDER_EXIF_DATE = "exif_date"
+ORDER_CAMERA = "camera"
+# Порядки, которым нужен индекс метаданных
+EXIF_ORDERS = (ORDER_EXIF_DATE, ORDER_CAMERA)
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_key(name):
+    """IMG_9 < IMG_10: числа в имени сравниваются как числа."""
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS.split(name)]
+
+
+def _clean(value):
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "ignore")
+    value = str(value).strip("\x00 ").strip() if value is not None else ""
+    return value or None
+
+
+def _header_exif(img):
+    if img.format == "PNG":
+        # PngImageFile.getexif() декодирует пиксели, если чанк eXIf идёт после IDAT,
+        # поэтому берём только то, что уже прочитано из заголовка
+        exif = Image.Exif()
+        raw = img.info.get("exif")
+        if raw:
+            exif.load(raw)
+        return exif
+    return img.getexif()
+
+
+def image_metadata(img):
+    """Дата съёмки и камера уже открытого (ленивого) изображения. Пустой dict, если EXIF не читается."""
+    try:
+        exif = _header_exif(img)
+    except Exception:
+        return {}
+    exif_ifd = exif.get_ifd(EXIF_IFD)
+    taken = _clean(exif_ifd.get(TAG_DATETIME_ORIGINAL)) or _clean(exif.get(TAG_DATETIME))
+    subsec = _clean(exif_ifd.get(TAG_SUBSEC_ORIGINAL)) or ""
+    serial = _clean(exif_ifd.get(TAG_BODY_SERIAL))
+    model = " ".join(filter(None, (_clean(exif.get(TAG_MAKE)), _clean(exif.get(TAG_MODEL)))))
+    camera = f"{model} #{serial}" if serial else (model or None)
+    return {"taken": f"{taken}.{subsec.ljust(3, '0')}" if taken else None, "camera": camera}
+
+
+def sort_photos(photos, order=ORDER_NAME, index=None):
+    """Сортирует пути файлов для нумерации. Файлы без метаданных идут после датированных."""
+    index = index or {}
+    if order == ORDER_NATURAL:
+        return sorted(photos, key=lambda p: natural_key(p.name))
+    if order == ORDER_EXIF_DATE:
+        def key(p):
+            taken = index.get(p, {}).get("taken")
+            return (taken is None, taken or "", natural_key(p.name))
+        return sorted(photos, key=key)
+    if order == ORDER_CAMERA:
+        def key(p):
+            meta = index.get(p, {})
+            camera = meta.get("camera")
+            taken = meta.get("taken")
+            return (camera is None, camera or "", taken is None, taken or "", natural_key(p.name))
+        return sorted(photos, key=key)
+    return sorted(photos, key=lambda x: x.name)
@@ -0,0 +1,66 @@
+# operations.py
+# Обработка одного файла без интерфейса: общая для watch-режима и фоновых процессов
+import os
+import uuid
+from io import BytesIO
+from PIL import Image, UnidentifiedImageError
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass
+from imaging import convert_image, watermark_image
+from probe import check_image_bytes, ImageRejected
+
+MODES = ("convert", "watermark")
+# Ошибки самого файла: повтор на другом воркере ничего не изменит.
+# Обрезанные файлы отсеивает check_image_bytes (ImageRejected) до декодирования,
+# поэтому оставшийся OSError — это сбой диска или сети, и его стоит повторить
+PERMANENT_ERRORS = (ImageRejected, UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, ValueError)
+
+
+def is_permanent_error(e):
+    return isinstance(e, PERMANENT_ERRORS)
+
+
+def process_file(src, dst, settings):
+    """
+    Обрабатывает src по настройкам задания и сохраняет JPEG в dst.
+    settings: dict с ключами mode ('convert' или 'watermark'), scale_percent,
+    а для водяного знака — watermark_path и/или text, text_options, position, opacity, size_percent.
+    """
+    mode = settings.get("mode", "convert")
+    scale_percent = settings.get("scale_percent", 100)
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    with open(src, "rb") as f:
+        data = f.read()
+    check_image_bytes(data, src)
+    with Image.open(BytesIO(data)) as img:
+        icc_profile = img.info.get('icc_profile')
+        if mode == "convert":
+            out = convert_image(img, scale_percent)
+        elif mode == "watermark":
+            out = watermark_image(
+                img,
+                settings.get("watermark_path"),
+                position=settings.get("position", "bottom_right"),
+                opacity=settings.get("opacity", 0.6),
+                scale=settings.get("size_percent", 25) / 100.0,
+                scale_percent=scale_percent,
+                text=settings.get("text"),
+                text_options=settings.get("text_options")
+            )
+            icc_profile = None
+        else:
+            raise ValueError(f"Неизвестный режим: {mode}")
+    # Пишем во временный файл и переименовываем, чтобы в выходной папке не было недописанных JPEG.
+    # Имя уникально для каждого вызова: два процесса с одной задачей не пишут в один файл
+    tmp_path = f"{dst}.{uuid.uuid4().hex}.part"
+    try:
+        out.save(tmp_path, "JPEG", quality=100, optimize=True, progressive=True, icc_profile=icc_profile)
+        os.replace(tmp_path, dst)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return dst
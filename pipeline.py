@@ -0,0 +1,186 @@
+# pipeline.py
+# Конвейер обработки: чтение из ZIP, декодирование/обработка и запись в архив идут одновременно.
+#
+#   поток чтения ──(очередь)──> поток обработки ──(очередь)──> поток скрипта (архив, лог, прогресс)
+#
+# Очереди ограничены, поэтому в памяти одновременно лежит лишь несколько изображений.
+# Запись в архив и вызовы Streamlit остаются в потоке скрипта — из других потоков их делать нельзя.
+# PIL отпускает GIL на декодировании, ресайзе и кодировании, так что стадии действительно перекрываются.
+import queue
+import zipfile
+import threading
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from utils import SUPPORTED_EXTS
+from probe import check_image_bytes
+
+QUEUE_SIZE = 4
+# Сколько байт исходников и результатов может одновременно лежать в очередях конвейера
+QUEUE_MEMORY = 256 * 1024 * 1024
+_POLL = 0.1
+_DONE = object()
+
+
+class Source:
+    """Изображение из загрузки: член ZIP-архива или отдельный файл. Данные читаются только в open()."""
+
+    __slots__ = ("rel_path", "size", "_zip", "_member", "_upload")
+
+    def __init__(self, rel_path, size, zip_ref=None, member=None, upload=None):
+        self.rel_path = rel_path
+        self.size = size
+        self._zip = zip_ref
+        self._member = member
+        self._upload = upload
+
+    @property
+    def name(self):
+        return self.rel_path.name
+
+    def open(self):
+        if self._zip is not None:
+            return self._zip.open(self._member)
+        return BytesIO(self._upload.getvalue())
+
+    def read(self):
+        with self.open() as f:
+            return f.read()
+
+
+def _safe_rel_path(name):
+    # Как zipfile.extract: без абсолютных путей и выхода из папки через ..
+    parts = [p for p in PurePosixPath(name.replace("\\", "/")).parts if p not in ("/", "..", ".", "")]
+    return Path(*parts) if parts else None
+
+
+def collect_sources(uploaded_files, log):
+    """
+    Шаг 1 без распаковки на диск: ZIP читается прямо из загруженного файла,
+    каждое изображение — ссылка на член архива.
+    """
+    sources = []
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith(".zip"):
+            uploaded.seek(0)
+            try:
+                zip_ref = zipfile.ZipFile(uploaded, "r")
+            except Exception as e:
+                log.error(f"❌ Ошибка открытия архива {uploaded.name}: {e}")
+                continue
+            found = 0
+            for info in zip_ref.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(SUPPORTED_EXTS):
+                    continue
+                rel_path = _safe_rel_path(info.filename)
+                if rel_path is None:
+                    log.error(f"❌ Не удалось извлечь {info.filename} из {uploaded.name}: недопустимое имя")
+                    continue
+                sources.append(Source(rel_path, info.file_size, zip_ref=zip_ref, member=info))
+                found += 1
+            log.append(f"📦 Архив {uploaded.name}: найдено {found} изображений.")
+        elif uploaded.name.lower().endswith(SUPPORTED_EXTS):
+            uploaded.seek(0, 2)
+            size = uploaded.tell()
+            uploaded.seek(0)
+            sources.append(Source(Path(uploaded.name), size, upload=uploaded))
+            log.append(f"🖼️ Файл {uploaded.name}: добавлен.")
+        else:
+            log.error(f"❌ {uploaded.name}: не поддерживается.")
+    return sources
+
+
+def common_root(sources):
+    """Общая верхняя папка всех файлов (её не нужно повторять в путях архива) или None."""
+    tops = {src.rel_path.parts[0] for src in sources if len(src.rel_path.parts) > 1}
+    if len(tops) == 1 and all(len(src.rel_path.parts) > 1 for src in sources):
+        return Path(tops.pop())
+    return None
+
+
+def read_checked(src):
+    """Стадия чтения: байты файла + полная проверка, включая обрезанный хвост (бросает ImageRejected)."""
+    data = src.read()
+    check_image_bytes(data, src.name)
+    return data
+
+
+def queue_size(plan):
+    """Глубина очередей по плану задания (probe.plan_job): чем крупнее файлы, тем короче очереди."""
+    per_item = 2 * max(plan.get("max_bytes", 0), 1)
+    return max(1, min(QUEUE_SIZE, QUEUE_MEMORY // per_item))
+
+
+def run_pipeline(items, read, transform, maxsize=QUEUE_SIZE):
+    """
+    Генератор (item, result, error) в исходном порядке items.
+    read(item) выполняется в потоке чтения, transform(item, data) — в потоке обработки,
+    а тело цикла вызывающего кода — третья стадия. Ошибка стадии относится к своему элементу
+    и не останавливает конвейер. Выход из цикла (break/исключение) останавливает потоки.
+    """
+    read_q = queue.Queue(maxsize)
+    out_q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(q, value):
+        while not stop.is_set():
+            try:
+                q.put(value, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def reader():
+        try:
+            for item in items:
+                try:
+                    data, error = read(item), None
+                except Exception as e:
+                    data, error = None, e
+                if not put(read_q, (item, data, error)):
+                    return
+        finally:
+            put(read_q, _DONE)
+
+    def worker():
+        try:
+            while True:
+                entry = get(read_q)
+                if entry is _DONE:
+                    return
+                item, data, error = entry
+                result = None
+                if error is None:
+                    try:
+                        result = transform(item, data)
+                    except Exception as e:
+                        error = e
+                if not put(out_q, (item, result, error)):
+                    return
+        finally:
+            put(out_q, _DONE)
+
+    threads = [
+        threading.Thread(target=reader, name="pipeline-read", daemon=True),
+        threading.Thread(target=worker, name="pipeline-transform", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            entry = out_q.get()
+            if entry is _DONE:
+                break
+            yield entry
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
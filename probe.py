@@ -0,0 +1,183 @@
+# probe.py
+# Быстрая предпроверка: формат по сигнатуре, размеры из заголовка, признаки обрезанного файла.
+# Пиксели не декодируются — Image.open читает только заголовок.
+import os
+import struct
+from io import BytesIO
+from PIL import Image
+from metadata import image_metadata
+
+HEAD_BYTES = 32
+TAIL_BYTES = 64
+# Некоторые камеры дописывают данные после маркера EOI, поэтому у JPEG смотрим хвост побольше.
+# Если маркера конца нет и там (видео «живого фото», мусор после IEND у PNG),
+# файл проверяется полным декодированием
+JPEG_TAIL_BYTES = 64 * 1024
+# Форматы, у которых после маркера конца бывают лишние данные
+TRAILER_FORMATS = ("JPEG", "PNG")
+
+# Форматы, которые определяет sniff_format, и расширения, которые им соответствуют
+FORMAT_EXTS = {
+    "JPEG": ('.jpg', '.jpeg'),
+    "PNG": ('.png',),
+    "BMP": ('.bmp',),
+    "WEBP": ('.webp',),
+    "TIFF": ('.tiff', '.tif'),
+    "HEIF": ('.heic', '.heif'),
+}
+HEIF_BRANDS = (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1")
+
+# Грубые оценки для планирования задания
+BYTES_PER_PIXEL = 4          # RGBA при наложении водяного знака
+SECONDS_PER_MEGAPIXEL = 0.06  # декодирование + JPEG quality=100 optimize
+
+
+def sniff_format(head):
+    """Определяет реальный формат по первым байтам файла. None — неизвестная сигнатура."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head.startswith(b"BM"):
+        return "BMP"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIF_BRANDS:
+        return "HEIF"
+    return None
+
+
+def _is_truncated(fmt, head, tail, size):
+    if fmt == "JPEG":
+        return b"\xff\xd9" not in tail
+    if fmt == "PNG":
+        return b"IEND" not in tail
+    if fmt == "BMP" and len(head) >= 6:
+        return struct.unpack("<I", head[2:6])[0] > size
+    if fmt == "WEBP":
+        return struct.unpack("<I", head[4:8])[0] + 8 > size
+    return False
+
+
+def _decodes(f):
+    f.seek(0)
+    try:
+        with Image.open(f) as img:
+            img.load()
+        return True
+    except Exception:
+        return False
+
+
+class ImageRejected(ValueError):
+    """Файл не прошёл проверку и не обрабатывается."""
+
+
+def probe_stream(f, size, name="", check_tail=True, metadata=False):
+    """
+    Проверяет открытый бинарный файл (с поддержкой seek).
+    check_tail=False — только заголовок: для членов ZIP чтение хвоста означает распаковку всего файла.
+    metadata=True — заодно взять из заголовка дату съёмки и камеру (metadata.image_metadata).
+    Возвращает dict: ok, format, width, height, size, reason, mislabeled (и metadata).
+    """
+    result = {"ok": False, "format": None, "width": 0, "height": 0, "size": size, "reason": None, "mislabeled": False}
+    f.seek(0)
+    head = f.read(HEAD_BYTES)
+    fmt = sniff_format(head)
+    if fmt is None:
+        result["reason"] = "неизвестный или неподдерживаемый формат"
+        return result
+    result["format"] = fmt
+    ext = os.path.splitext(name)[1].lower()
+    result["mislabeled"] = bool(ext) and ext not in FORMAT_EXTS[fmt]
+    if check_tail:
+        tail_bytes = JPEG_TAIL_BYTES if fmt == "JPEG" else TAIL_BYTES
+        f.seek(max(0, size - tail_bytes))
+        tail = f.read(tail_bytes)
+        if _is_truncated(fmt, head, tail, size) and (fmt not in TRAILER_FORMATS or not _decodes(f)):
+            result["reason"] = "файл обрезан"
+            return result
+    f.seek(0)
+    try:
+        with Image.open(f) as img:
+            result["width"], result["height"] = img.size
+            if metadata:
+                result["metadata"] = image_metadata(img)
+    except Exception as e:
+        result["reason"] = f"не читается заголовок ({e})"
+        return result
+    if not result["width"] or not result["height"]:
+        result["reason"] = "нулевой размер изображения"
+        return result
+    result["ok"] = True
+    return result
+
+
+def check_image_bytes(data, name=""):
+    """Полная проверка уже прочитанного файла (включая хвост). Бросает ImageRejected."""
+    info = probe_stream(BytesIO(data), len(data), name=name)
+    if not info["ok"]:
+        raise ImageRejected(info["reason"])
+    return info
+
+
+def plan_job(probes):
+    """Оценка пиковой памяти и времени по результатам предпроверки."""
+    ok = [p for p in probes if p["ok"]]
+    pixels = [p["width"] * p["height"] for p in ok]
+    total_pixels = sum(pixels)
+    return {
+        "count": len(ok),
+        "total_bytes": sum(p["size"] for p in ok),
+        "max_bytes": max((p["size"] for p in ok), default=0),
+        "megapixels": total_pixels / 1_000_000,
+        # исходник и результат одновременно в памяти
+        "peak_memory": 2 * BYTES_PER_PIXEL * max(pixels, default=0),
+        "est_seconds": total_pixels / 1_000_000 * SECONDS_PER_MEGAPIXEL,
+    }
+
+
+def validate_sources(sources, log, strict=True, metadata_index=None):
+    """
+    Предпроход по источникам (pipeline.Source): только заголовки, пиксели не декодируются.
+    Битые и неподдерживаемые файлы отбрасываются с записью в лог; обрезанный хвост
+    проверяется позже, при чтении файла в конвейере.
+    strict=False — для режимов, которым пиксели не нужны: отклонённые файлы только помечаются предупреждением.
+    metadata_index — dict, который заполняется метаданными годных файлов (относительный путь -> metadata),
+    чтобы ради сортировки не открывать каждый файл ещё раз.
+    Возвращает (годные источники, отклонённые источники, план задания).
+    """
+    valid = []
+    rejected = []
+    probes = []
+    for src in sources:
+        try:
+            with src.open() as f:
+                info = probe_stream(f, src.size, name=src.name, check_tail=False, metadata=metadata_index is not None)
+        except Exception as e:
+            info = {"ok": False, "reason": str(e)}
+        if not info["ok"]:
+            if strict:
+                log.error(f"❌ {src.rel_path}: отклонён при проверке — {info['reason']}")
+            else:
+                log.append(f"⚠️ {src.rel_path}: не прошёл проверку — {info['reason']}")
+            rejected.append(src)
+            continue
+        if info["mislabeled"]:
+            log.append(f"⚠️ {src.rel_path}: расширение не совпадает с форматом ({info['format']})")
+        if metadata_index is not None:
+            metadata_index[src.rel_path] = info["metadata"]
+        probes.append(info)
+        valid.append(src)
+    return valid, rejected, plan_job(probes)
+
+
+def format_plan(plan):
+    minutes, seconds = divmod(int(plan["est_seconds"]), 60)
+    eta = f"{minutes} мин {seconds:02d} сек" if minutes else f"{seconds} сек"
+    return (
+        f"{plan['count']} изображений, {plan['megapixels']:.0f} Мп, {plan['total_bytes'] / 1024 / 1024:.1f} МБ. "
+        f"Пиковая память ≈ {plan['peak_memory'] / 1024 / 1024:.0f} МБ, время ≈ {eta}."
+    )
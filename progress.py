@@ -0,0 +1,59 @@
+# progress.py
+import time
+
+UPDATE_INTERVAL = 0.25  # секунд между обновлениями интерфейса
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60:02d} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60:02d} сек"
+    return f"{seconds} сек"
+
+
+class ProgressReporter:
+    """
+    Общий индикатор прогресса для всех режимов.
+    Обновления прогресс-бара и статуса объединяются: не чаще раза в interval секунд,
+    поэтому на тысячах мелких файлов трафик в браузер почти не растёт.
+    """
+
+    def __init__(self, st, total, label="Обработано файлов", interval=UPDATE_INTERVAL):
+        self.total = max(total, 0)
+        self.label = label
+        self.interval = interval
+        self.done = 0
+        self.bytes_done = 0
+        self.start = time.monotonic()
+        self._last_update = 0.0
+        self.progress_bar = st.progress(0)
+        self.status_placeholder = st.empty()
+
+    def update(self, count=1, nbytes=0):
+        self.done += count
+        self.bytes_done += nbytes
+        now = time.monotonic()
+        if now - self._last_update >= self.interval or self.done >= self.total:
+            self._render(now)
+
+    def finish(self):
+        self._render(time.monotonic())
+
+    def _render(self, now):
+        self._last_update = now
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.done / elapsed
+        mb_rate = self.bytes_done / 1024 / 1024 / elapsed
+        fraction = min(self.done / self.total, 1.0) if self.total else 1.0
+        self.progress_bar.progress(fraction)
+        parts = [f"{self.label}: <b>{self.done}/{self.total}</b>", f"{rate:.1f} изобр./с"]
+        if self.bytes_done:
+            parts.append(f"{mb_rate:.1f} МБ/с")
+        if 0 < self.done < self.total and rate > 0:
+            parts.append(f"осталось ≈ {_format_eta((self.total - self.done) / rate)}")
+        self.status_placeholder.markdown(
+            f"<span style='color:#4a90e2;'>{' · '.join(parts)}</span>",
+            unsafe_allow_html=True
+        )
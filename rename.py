@@ -1,154 +1,180 @@
 # rename.py
-import os
-import zipfile
-import tempfile
-from pathlib import Path
+from io import BytesIO
 from PIL import Image
 import streamlit as st
-from utils import filter_large_files, SUPPORTED_EXTS
+from utils import filter_large_files
+from joblog import JobLog, store_job_log, recent_text
+from progress import ProgressReporter
+from probe import validate_sources, format_plan, check_image_bytes, ImageRejected
+from archive import ArchiveSink
+from pipeline import collect_sources, common_root, run_pipeline, queue_size
+from metadata import ORDER_NAME, ORDER_NATURAL, ORDER_EXIF_DATE, ORDER_CAMERA, EXIF_ORDERS, sort_photos
 
-def process_rename_mode(uploaded_files, scale_percent=100):
+# Варианты порядка нумерации для интерфейса
+ORDER_OPTIONS = {
+    "По имени файла": ORDER_NAME,
+    "По имени, числа как числа (IMG_9 → IMG_10)": ORDER_NATURAL,
+    "По дате съёмки (EXIF)": ORDER_EXIF_DATE,
+    "По камере, затем по дате съёмки": ORDER_CAMERA,
+}
+
+def _read_for_rename(src, checked):
+    """
+    Стадия чтения: переименованию пиксели не нужны, поэтому файл, не прошедший проверку,
+    не отбрасывается, а возвращается вместе с причиной. Возвращает (байты, причина или None).
+    """
+    data = src.read()
+    if checked:
+        try:
+            check_image_bytes(data, src.name)
+        except ImageRejected as e:
+            return data, e
+    return data, None
+
+def _rename_transform(src, read_result, numbered, scale_percent):
+    """
+    Стадия обработки конвейера: JPG/JPEG при масштабе не 100% пережимается, остальное идёт как есть.
+    Возвращает (байты, изменено ли разрешение, причина отклонения, ошибка изменения разрешения).
+    """
+    data, rejection = read_result
+    if rejection is not None or not numbered:
+        return data, False, rejection, None
+    # resize только для JPG/JPEG
+    if src.rel_path.suffix.lower() in ['.jpg', '.jpeg'] and scale_percent != 100:
+        try:
+            with Image.open(BytesIO(data)) as img:
+                w, h = img.size
+                new_w = max(1, int(w * scale_percent / 100))
+                new_h = max(1, int(h * scale_percent / 100))
+                img = img.resize((new_w, new_h), Image.LANCZOS)
+            buf = BytesIO()
+            img.save(buf, "JPEG", quality=100, optimize=True, progressive=True)
+            return buf.getvalue(), True, None, None
+        except Exception as e:
+            return data, False, None, e
+    return data, False, None, None
+
+
+def process_rename_mode(uploaded_files, scale_percent=100, order=ORDER_NAME):
     uploaded_files = filter_large_files(uploaded_files)
     if uploaded_files and st.button("Обработать и скачать архив", key="process_rename_btn"):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            all_images = []
-            log = []
+        log = JobLog()
+        try:
             st.markdown("""
                 <div style='font-size:1.3em;font-weight:600;margin-bottom:0.5em;'>⏳ Шаг 1: Сбор файлов</div>
             """, unsafe_allow_html=True)
-            for uploaded in uploaded_files:
-                if uploaded.name.lower().endswith(".zip"):
-                    zip_temp = os.path.join(temp_dir, uploaded.name)
-                    with open(zip_temp, "wb") as f:
-                        f.write(uploaded.read())
-                    try:
-                        with zipfile.ZipFile(zip_temp, "r") as zip_ref:
-                            for member in zip_ref.namelist():
-                                try:
-                                    zip_ref.extract(member, temp_dir)
-                                except Exception as e:
-                                    log.append(f"❌ Не удалось извлечь {member} из {uploaded.name}: {e}")
-                    except Exception as e:
-                        log.append(f"❌ Ошибка открытия архива {uploaded.name}: {e}")
-                        continue
-                    extracted = [file for file in Path(temp_dir).rglob("*") if file.is_file() and file.suffix.lower() in SUPPORTED_EXTS]
-                    log.append(f"📦 Архив {uploaded.name}: найдено {len(extracted)} изображений.")
-                    all_images.extend(extracted)
-                elif uploaded.name.lower().endswith(SUPPORTED_EXTS):
-                    img_temp = os.path.join(temp_dir, uploaded.name)
-                    with open(img_temp, "wb") as f:
-                        f.write(uploaded.read())
-                    all_images.append(Path(img_temp))
-                    log.append(f"🖼️ Файл {uploaded.name}: добавлен.")
-                else:
-                    log.append(f"❌ {uploaded.name}: не поддерживается.")
-            st.markdown(f"<div style='margin-bottom:1em;'>🔍 Найдено <b>{len(all_images)}</b> изображений для обработки.</div>", unsafe_allow_html=True)
-            if not all_images:
+            # ZIP не распаковывается на диск: изображения читаются из архива по мере обработки
+            all_images = collect_sources(uploaded_files, log)
+            # Предпроверка: сигнатура и размеры из заголовка — без декодирования пикселей.
+            # Не прошедшие её файлы не нумеруются, но остаются в архиве под исходными именами.
+            # Индекс EXIF для сортировки собирается в том же проходе и только если он нужен
+            meta_index = {} if order in EXIF_ORDERS else None
+            all_images, rejected, plan = validate_sources(all_images, log, strict=False, metadata_index=meta_index)
+            if rejected:
+                st.warning(f"Не прошли проверку: {len(rejected)} файлов — они сохранены под исходными именами (подробности в логе).")
+            if all_images:
+                st.caption("📐 " + format_plan(plan))
+            st.markdown(f"<div style='margin-bottom:1em;'>🔍 Найдено <b>{len(all_images) + len(rejected)}</b> изображений для обработки.</div>", unsafe_allow_html=True)
+            if not all_images and not rejected:
                 st.error("Не найдено ни одного поддерживаемого изображения.")
-                # Создаём пустой архив с логом ошибок
-                result_zip = os.path.join(temp_dir, "result_rename.zip")
-                with zipfile.ZipFile(result_zip, "w") as zipf:
-                    log_path = os.path.join(temp_dir, "log.txt")
-                    with open(log_path, "w", encoding="utf-8") as logf:
-                        logf.write("\n".join(log))
-                    zipf.write(log_path, arcname="log.txt")
                 st.session_state["result_zip"] = None # Удаляю блок:
                 st.session_state["stats"] = {"total": 0, "renamed": 0, "skipped": 0}
-                st.session_state["log"] = log
+                store_job_log(st.session_state, log)
             else:
-                exts = SUPPORTED_EXTS
                 renamed = 0
                 skipped = 0
-                folders = sorted({img.parent for img in all_images})
-                if len(folders) > 0:
+                folder_photos = {}
+                for src in all_images:
+                    folder_photos.setdefault(src.rel_path.parent, {})[src.rel_path] = src
+                folders = sorted(folder_photos)
+                # Корень архива: если всё лежит в одной папке, она не попадает в пути внутри ZIP
+                zip_root = common_root(all_images + rejected)
+
+                def arcname(path):
+                    return path.relative_to(zip_root) if zip_root else path
+
+                # Файлы пишутся в архив сразу под новыми именами, без переименования на диске
+                sink = ArchiveSink()
+                if all_images or rejected:
                     st.markdown("""
                         <div style='font-size:1.3em;font-weight:600;margin-bottom:0.5em;'>🛠️ Шаг 2: Переименование файлов</div>
                     """, unsafe_allow_html=True)
-                    progress_bar = st.progress(0)
-                    status_placeholder = st.empty()
-                    for i, folder in enumerate(folders, 1):
-                        photos = [f for f in folder.iterdir() if f.is_file() and f.suffix.lower() in exts]
-                        photos_sorted = sorted(photos, key=lambda x: x.name)
-                        relative_folder_path = folder.relative_to(temp_dir)
-                        if len(photos_sorted) > 0:
-                            for idx, photo in enumerate(photos_sorted, 1):
-                                new_name = f"{idx}{photo.suffix.lower()}"
-                                new_path = photo.parent / new_name
-                                relative_photo_path = photo.relative_to(temp_dir)
-                                relative_new_path = new_path.relative_to(temp_dir)
-                                if new_path.exists() and new_path != photo:
-                                    log.append(f"Пропущено: Файл '{relative_new_path}' уже существует.")
-                                    skipped += 1
-                                else:
-                                    # resize только для JPG/JPEG
-                                    if photo.suffix.lower() in ['.jpg', '.jpeg'] and scale_percent != 100:
-                                        try:
-                                            img = Image.open(photo)
-                                            w, h = img.size
-                                            new_w = max(1, int(w * scale_percent / 100))
-                                            new_h = max(1, int(h * scale_percent / 100))
-                                            img = img.resize((new_w, new_h), Image.LANCZOS)
-                                            img.save(new_path, "JPEG", quality=100, optimize=True, progressive=True)
-                                            photo.unlink()  # удалить оригинал
-                                            log.append(f"Переименовано и изменено разрешение: '{relative_photo_path}' -> '{relative_new_path}'")
-                                            renamed += 1
-                                            continue
-                                        except Exception as e:
-                                            log.append(f"Ошибка изменения разрешения для '{relative_photo_path}': {e}")
-                                            skipped += 1
-                                            continue
-                                    photo.rename(new_path)
-                                    log.append(f"Переименовано: '{relative_photo_path}' -> '{relative_new_path}'")
-                                    renamed += 1
-                        else:
-                            log.append(f"Инфо: В папке '{relative_folder_path}' нет фото.")
+                    # Порядок внутри папок известен заранее, а номера выдаются на стадии записи,
+                    # поэтому файлы, не прошедшие проверку при чтении, не оставляют пропусков в нумерации.
+                    # Элемент конвейера — (источник, нумеруется ли он)
+                    items = []
+                    for folder in folders:
+                        photos = folder_photos[folder]
+                        items.extend((photos[path], True) for path in sort_photos(list(photos), order, meta_index))
+                    items.extend((src, False) for src in rejected)
+                    counters = {}
+                    progress = ProgressReporter(st, len(items))
+                    pipeline = run_pipeline(
+                        items,
+                        lambda item: _read_for_rename(*item),
+                        lambda item, read_result: _rename_transform(item[0], read_result, item[1], scale_percent),
+                        queue_size(plan)
+                    )
+                    for (src, numbered), result, error in pipeline:
+                        progress.update(nbytes=src.size)
+                        photo = src.rel_path
+                        if error is not None:
+                            log.error(f"❌ {photo}: ошибка чтения ({error})")
                             skipped += 1
-                        progress = min(i / len(folders), 1.0)
-                        progress_bar.progress(progress)
-                        status_placeholder.markdown(f"<span style='color:#4a90e2;'>Обработано папок: <b>{i}/{len(folders)}</b></span>", unsafe_allow_html=True)
+                            continue
+                        data, resized, rejection, resize_error = result
+                        if rejection is not None:
+                            log.append(f"⚠️ {photo}: не прошёл проверку — {rejection}")
+                        if resize_error is not None:
+                            log.error(f"Ошибка изменения разрешения для '{photo}': {resize_error}")
+                        if not numbered or rejection is not None or resize_error is not None:
+                            skipped += 1
+                            # Как и раньше, файл остаётся в архиве под исходным именем;
+                            # если оно уже занято номером, файл получает суффикс, но не теряется
+                            name = sink.add_bytes(data, arcname(photo), unique=True)
+                            if name != arcname(photo).as_posix():
+                                log.append(f"⚠️ Имя '{photo}' уже занято, файл сохранён как '{name}'.")
+                            continue
+                        idx = counters.get(photo.parent, 0) + 1
+                        counters[photo.parent] = idx
+                        new_path = photo.parent / f"{idx}{photo.suffix.lower()}"
+                        name = sink.add_bytes(data, arcname(new_path), unique=True)
+                        if name != arcname(new_path).as_posix():
+                            log.append(f"⚠️ {photo}: имя '{new_path}' уже занято, файл сохранён как '{name}'.")
+                            renamed += 1
+                        elif resized:
+                            log.append(f"Переименовано и изменено разрешение: '{photo}' -> '{new_path}'")
+                            renamed += 1
+                        else:
+                            log.append(f"Переименовано: '{photo}' -> '{new_path}'")
+                            renamed += 1
+                    progress.finish()
                 st.markdown("""
                     <div style='font-size:1.3em;font-weight:600;margin:1em 0 0.5em 0;'>📦 Шаг 3: Архивация результата</div>
                 """, unsafe_allow_html=True)
-                # Архивация результата
-                extracted_items = [p for p in Path(temp_dir).iterdir() if p.name != uploaded_files[0].name]
-                zip_root = Path(temp_dir)
-                if len(extracted_items) == 1 and extracted_items[0].is_dir():
-                    zip_root = extracted_items[0]
-                files_to_zip = [file for file in Path(zip_root).rglob("*") if file.is_file() and file.suffix.lower() in exts or file.name == "log.txt"]
+                # Архивация результата: записи уже в архиве, остаётся дописать центральный каталог
                 st.write("[DEBUG] Начинаю архивацию результата...")
-                st.write(f"[DEBUG] files_to_zip: {[str(f) for f in files_to_zip]}")
-                log_path = os.path.join(temp_dir, "log.txt")
-                if os.path.exists(log_path):
-                    files_to_zip.append(Path(log_path))
                 try:
-                    result_zip = os.path.join(temp_dir, "result_rename.zip")
-                    with zipfile.ZipFile(result_zip, "w") as zipf:
-                        for file in files_to_zip:
-                            arcname = file.relative_to(zip_root)
-                            zipf.write(file, arcname=arcname)
+                    sink.close()
                     st.write("[DEBUG] Архивация завершена, архив сохранён в session_state")
-                    with open(result_zip, "rb") as f:
-                        st.session_state["result_zip"] = f.read()
+                    st.session_state["result_zip"] = sink.getvalue()
                     st.session_state["stats"] = {
-                        "total": len(all_images),
+                        "total": len(all_images) + len(rejected),
                         "renamed": renamed,
                         "skipped": skipped
                     }
-                    st.session_state["log"] = log
+                    store_job_log(st.session_state, log)
                 except Exception as e:
                     st.error(f"Ошибка при архивации или чтении архива: {e}")
                     st.write(f"[DEBUG] Ошибка архивации: {e}")
-                    result_zip = os.path.join(temp_dir, "result_rename.zip")
-                    with zipfile.ZipFile(result_zip, "w") as zipf:
-                        log.append(f"Ошибка архивации: {e}")
-                        log_path = os.path.join(temp_dir, "log.txt")
-                        with open(log_path, "w", encoding="utf-8") as logf:
-                            logf.write("\n".join(log))
-                        zipf.write(log_path, arcname="log.txt")
+                    log.error(f"Ошибка архивации: {e}")
                     st.session_state["result_zip"] = None # Теперь только обработка и запись в session_state
-                    st.session_state["stats"] = {"total": len(all_images), "renamed": renamed, "skipped": skipped}
-                    st.session_state["log"] = log
+                    st.session_state["stats"] = {"total": len(all_images) + len(rejected), "renamed": renamed, "skipped": skipped}
+                    store_job_log(st.session_state, log)
                 st.success(f"✅ Успешно переименовано: {renamed} файлов. Пропущено: {skipped}.")
                 if skipped > 0:
-                    with st.expander("Показать подробный лог", expanded=False):
-                        st.text_area("Лог:", value="\n".join(log), height=300, disabled=True)
+                    with st.expander("Показать последние записи лога", expanded=False):
+                        st.text_area("Лог:", value=recent_text(log), height=300, disabled=True)
+        finally:
+            # Файл лога закрывается, даже если обработка прервалась исключением
+            log.close()
@@ -0,0 +1,149 @@
+# Очередь заданий и воркеры на одной машине: несколько локальных воркеров над временной папкой очереди
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from pathlib import Path
+from PIL import Image
+from jobqueue import JobQueue, MAX_ATTEMPTS, run_distributed
+from worker import run_worker
+
+WORKERS = 3
+
+
+class _Source:
+    """Минимальный аналог pipeline.Source: файл на диске с относительным путём."""
+
+    def __init__(self, path, rel_path):
+        self.path = path
+        self.rel_path = rel_path
+
+    def open(self):
+        return open(self.path, "rb")
+
+
+class _Progress:
+    def __init__(self):
+        self.done = 0
+
+    def update(self, count=1, nbytes=0):
+        self.done += count
+
+
+class _Log(list):
+    def error(self, message):
+        self.append(message)
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.queue = JobQueue(self.tmp / "queue")
+        self.settings = {"mode": "convert", "scale_percent": 100}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _image(self, name, color, fmt):
+        path = self.tmp / name
+        Image.new("RGB", (16, 16), color).save(path, fmt)
+        return path
+
+    def _run_workers(self, exit_when_idle=True):
+        procs = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(str(self.queue.root), f"test-{n}"),
+                kwargs={"idle_sleep": 0.05, "exit_when_idle": exit_when_idle}
+            )
+            for n in range(WORKERS)
+        ]
+        for proc in procs:
+            proc.start()
+        return procs
+
+    def test_workers_keep_same_named_results_apart(self):
+        png = self._image("a.png", (0, 255, 0), "PNG")
+        jpg = self._image("a.jpg", (255, 0, 0), "JPEG")
+        bad = self.tmp / "bad.jpg"
+        bad.write_bytes(b"not an image")
+        items = [(png, Path("d/a.jpg")), (jpg, Path("d/a.jpg")), (bad, Path("d/bad.jpg"))]
+        items += [(self._image(f"{n}.jpg", (0, 0, 255), "JPEG"), Path(f"d/{n}.jpg")) for n in range(6)]
+        job_id = self.queue.submit_job(self.settings, items)
+        for proc in self._run_workers():
+            proc.join(60)
+        tasks = {task["src"]: task for task in self.queue.job_tasks(job_id)}
+        self.assertEqual(len(tasks), len(items))
+        outputs = [task["dst"] for task in tasks.values()]
+        self.assertEqual(len(set(outputs)), len(outputs))
+        by_rel_color = []
+        for task in self.queue.job_tasks(job_id):
+            if task["rel"] == "d/a.jpg":
+                self.assertEqual(task["status"], "done")
+                with Image.open(self.queue.path(task["dst"])) as img:
+                    by_rel_color.append(img.getpixel((8, 8)))
+        # Зелёный PNG и красный JPEG — оба результата на месте
+        self.assertTrue(by_rel_color[0][1] > 200 and by_rel_color[0][0] < 50)
+        self.assertTrue(by_rel_color[1][0] > 200 and by_rel_color[1][1] < 50)
+        bad_task = next(task for task in tasks.values() if task["rel"] == "d/bad.jpg")
+        # Нечитаемый файл не перезапускается
+        self.assertEqual((bad_task["status"], bad_task["attempts"]), ("failed", 1))
+        status = self.queue.job_status(job_id)
+        self.assertEqual((status["done"], status["failed"]), (len(items) - 1, 1))
+
+    def test_run_distributed_collects_results_and_deletes_job(self):
+        sources = [
+            _Source(self._image("a.png", (0, 255, 0), "PNG"), Path("d/a.png")),
+            _Source(self._image("a.jpg", (255, 0, 0), "JPEG"), Path("d/a.jpg")),
+        ]
+        procs = self._run_workers(exit_when_idle=False)
+        try:
+            collected = []
+            progress = _Progress()
+            results, errors = run_distributed(
+                self.queue, self.settings, sources, progress, _Log(),
+                lambda out_path, rel: collected.append((rel, Image.open(out_path).convert("RGB").getpixel((8, 8)))) or rel,
+                poll_interval=0.05
+            )
+        finally:
+            for proc in procs:
+                proc.terminate()
+                proc.join()
+        self.assertEqual((len(results), errors, progress.done), (2, 0, 2))
+        colors = sorted(color for _, color in collected)
+        self.assertTrue(colors[0][0] < 50 and colors[1][0] > 200)
+        self.assertEqual(list((self.queue.root / "jobs").iterdir()), [])
+
+    def test_expired_lease_is_reclaimed_until_max_attempts(self):
+        job_id = self.queue.submit_job(self.settings, [(self._image("a.jpg", (255, 0, 0), "JPEG"), Path("a.jpg"))])
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            task = self.queue.claim(f"w{attempt}", lease_seconds=0.01)
+            self.assertEqual(task["attempts"], attempt)
+            time.sleep(0.02)
+        # Опоздавший воркер не может завершить задачу, аренду которой уже потерял
+        self.assertFalse(self.queue.complete(task["id"], "w1"))
+        self.assertIsNone(self.queue.claim("w-last"))
+        self.assertEqual(self.queue.job_status(job_id)["failed"], 1)
+
+    def test_renewed_lease_is_not_reclaimed(self):
+        self.queue.submit_job(self.settings, [(self._image("a.jpg", (255, 0, 0), "JPEG"), Path("a.jpg"))])
+        task = self.queue.claim("w1", lease_seconds=0.2)
+        for _ in range(3):
+            time.sleep(0.1)
+            self.assertTrue(self.queue.renew(task["id"], "w1", 0.2))
+        self.assertIsNone(self.queue.claim("w2"))
+        self.assertTrue(self.queue.complete(task["id"], "w1"))
+
+    def test_transient_error_is_retried_permanent_is_not(self):
+        self.queue.submit_job(self.settings, [(self._image("a.jpg", (255, 0, 0), "JPEG"), Path("a.jpg"))])
+        task = self.queue.claim("w1")
+        self.queue.fail(task["id"], "w1", "диск недоступен", task["attempts"])
+        task = self.queue.claim("w2")
+        self.assertEqual(task["attempts"], 2)
+        self.queue.fail(task["id"], "w2", "cannot identify image file", task["attempts"], permanent=True)
+        self.assertIsNone(self.queue.claim("w3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
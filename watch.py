@@ -0,0 +1,225 @@
+# watch.py
+# Режим «горячей папки»: следит за входными папками и обрабатывает только новые или изменённые файлы.
+#
+# Пример:
+#   python watch.py --input /mnt/share/incoming --output /mnt/share/ready --mode convert --scale 50
+#   python watch.py --input /mnt/share/incoming --output /mnt/share/ready --mode watermark --watermark watermarks/1.png
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from pathlib import Path
+from utils import SUPPORTED_EXTS
+from operations import process_file, MODES
+
+INDEX_NAME = ".photoflow_index.json"
+POLL_INTERVAL = 5.0
+HASH_CHUNK = 1024 * 1024
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FolderIndex:
+    """
+    Индекс уже обработанных файлов: путь -> mtime, размер, sha1, файл результата.
+    Хэш считается только когда изменились mtime или размер,
+    поэтому повторный обход папки почти ничего не стоит.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        # Файл результата -> исходник, которому он принадлежит
+        self.owners = {entry["output"]: key for key, entry in self.entries.items() if entry.get("output")}
+
+    def output(self, key):
+        entry = self.entries.get(key)
+        return entry.get("output") if entry else None
+
+    def owner(self, output):
+        return self.owners.get(output)
+
+    def is_unchanged(self, key, stat):
+        entry = self.entries.get(key)
+        return entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size
+
+    def same_content(self, key, digest):
+        entry = self.entries.get(key)
+        return entry is not None and entry["sha1"] == digest
+
+    def update(self, key, stat, digest, output):
+        old = self.output(key)
+        if old and old != output and self.owners.get(old) == key:
+            del self.owners[old]
+        if output:
+            self.owners[output] = key
+        self.entries[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": digest, "output": output}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class HotFolderWatcher:
+    def __init__(self, input_dirs, output_dir, settings, log=print):
+        self.input_dirs = [Path(d).resolve() for d in input_dirs]
+        self.output_dir = Path(output_dir).resolve()
+        self.settings = settings
+        self.log = log
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.index = FolderIndex(str(self.output_dir / INDEX_NAME))
+        # При нескольких входных папках результаты раскладываются по подпапкам с их именами;
+        # одноимённые входные папки получают суффикс _2, _3…
+        self.prefixes = {}
+        if len(self.input_dirs) > 1:
+            for input_dir in self.input_dirs:
+                name = input_dir.name
+                n = 2
+                while name in self.prefixes.values():
+                    name = f"{input_dir.name}_{n}"
+                    n += 1
+                self.prefixes[input_dir] = name
+        # Файлы, которые ещё копируются: ключ -> (mtime, size) с прошлого обхода
+        self.pending = {}
+
+    def _output_path(self, input_dir, src):
+        """
+        Файл результата для src. Уже обработанный исходник сохраняет свой прежний результат,
+        а занятое другим исходником имя (a.png и a.jpg -> a.jpg) получает суффикс _2, _3…, как в ArchiveSink.
+        """
+        key = str(src)
+        known = self.index.output(key)
+        if known:
+            return Path(known)
+        rel = src.relative_to(input_dir).with_suffix(".jpg")
+        if input_dir in self.prefixes:
+            rel = Path(self.prefixes[input_dir]) / rel
+        base = self.output_dir / rel
+        dst = base
+        n = 2
+        while self.index.owner(str(dst)) not in (None, key):
+            dst = base.with_name(f"{base.stem}_{n}{base.suffix}")
+            n += 1
+        return dst
+
+    def _candidates(self):
+        for input_dir in self.input_dirs:
+            if not input_dir.is_dir():
+                continue
+            for src in input_dir.rglob("*"):
+                if src.is_file() and src.suffix.lower() in SUPPORTED_EXTS and self.output_dir not in src.parents:
+                    yield input_dir, src
+
+    def scan_once(self):
+        """Один обход входных папок. Возвращает (обработано, ошибок)."""
+        processed = 0
+        errors = 0
+        seen = set()
+        for input_dir, src in self._candidates():
+            key = str(src)
+            seen.add(key)
+            try:
+                stat = src.stat()
+            except OSError:
+                continue
+            if self.index.is_unchanged(key, stat):
+                continue
+            # Ждём, пока файл перестанет меняться между обходами (фотограф ещё копирует)
+            signature = (stat.st_mtime, stat.st_size)
+            if self.pending.get(key) != signature:
+                self.pending[key] = signature
+                continue
+            del self.pending[key]
+            dst = self._output_path(input_dir, src)
+            try:
+                digest = file_hash(src)
+                if self.index.same_content(key, digest) and dst.exists():
+                    # Файл «тронули», но содержимое прежнее
+                    self.index.update(key, stat, digest, str(dst))
+                    continue
+                process_file(str(src), str(dst), self.settings)
+                self.index.update(key, stat, digest, str(dst))
+                processed += 1
+                self.log(f"✅ {src} → {dst}")
+            except Exception as e:
+                errors += 1
+                # Запоминаем и битые файлы, чтобы не повторять ошибку на каждом обходе
+                self.index.update(key, stat, None, None)
+                self.log(f"❌ {src}: ошибка обработки ({e})")
+        # Забываем «ожидающие» файлы, которые исчезли
+        for key in list(self.pending):
+            if key not in seen:
+                del self.pending[key]
+        self.index.save()
+        return processed, errors
+
+    def run(self, interval=POLL_INTERVAL, once=False):
+        while True:
+            processed, errors = self.scan_once()
+            if processed or errors:
+                self.log(f"Обход завершён: обработано {processed}, ошибок {errors}.")
+            if once and not self.pending:
+                return
+            time.sleep(interval)
+
+
+def build_settings(args):
+    settings = {"mode": args.mode, "scale_percent": args.scale}
+    if args.mode == "watermark":
+        if not args.watermark and not args.text:
+            raise SystemExit("Для режима watermark нужен --watermark или --text")
+        settings.update({
+            "watermark_path": os.path.abspath(args.watermark) if args.watermark else None,
+            "text": args.text,
+            "text_options": {"font_path": args.font, "color": args.color},
+            "position": args.position,
+            "opacity": args.opacity / 100.0,
+            "size_percent": args.size,
+        })
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhotoFlow: обработка новых файлов в горячих папках")
+    parser.add_argument("--input", action="append", required=True, help="Входная папка (можно указать несколько раз)")
+    parser.add_argument("--output", required=True, help="Папка для результатов")
+    parser.add_argument("--mode", choices=MODES, default="convert")
+    parser.add_argument("--scale", type=int, default=100, help="Масштаб, %% (10-100)")
+    parser.add_argument("--watermark", help="PNG/JPG водяного знака")
+    parser.add_argument("--text", help="Текст водяного знака (если не задан --watermark)")
+    parser.add_argument("--font", help="TTF/OTF-шрифт для текста")
+    parser.add_argument("--color", type=lambda v: tuple(int(v.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4)),
+                        default=(255, 255, 255), help="Цвет текста, #RRGGBB")
+    parser.add_argument("--position", default="bottom_right",
+                        choices=["top_left", "top_right", "center", "bottom_left", "bottom_right"])
+    parser.add_argument("--opacity", type=int, default=60, help="Прозрачность, %%")
+    parser.add_argument("--size", type=int, default=25, help="Размер водяного знака, %% от ширины фото")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Пауза между обходами, сек")
+    parser.add_argument("--once", action="store_true", help="Обработать текущие файлы и выйти")
+    args = parser.parse_args(argv)
+    watcher = HotFolderWatcher(args.input, args.output, build_settings(args))
+    try:
+        watcher.run(interval=args.interval, once=args.once)
+    except KeyboardInterrupt:
+        watcher.index.save()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# worker.py
+# Воркер очереди заданий: забирает задачи из общей папки очереди, обрабатывает и пишет результат обратно.
+#
+# Пример (несколько воркеров на одной машине):
+#   python worker.py --queue /mnt/shared/photoflow-queue --processes 4
+# Веб-процесс отправляет задания в ту же папку, если задана переменная PHOTOFLOW_QUEUE_DIR.
+#
+# Папка очереди должна быть общей для веб-процесса и всех воркеров (один хост или сетевой том).
+# На Heroku у дино нет общей файловой системы, поэтому в Procfile воркера нет, а
+# PHOTOFLOW_QUEUE_DIR там задавать нельзя — веб-процесс будет ждать задачи, которых никто не видит.
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from jobqueue import JobQueue, LEASE_SECONDS
+from operations import process_file, is_permanent_error
+
+IDLE_SLEEP = 1.0
+
+
+def _keep_lease(queue, task_id, worker_id, lease_seconds, done):
+    # Продлеваем аренду, пока идёт обработка: иначе долгую задачу заберёт второй воркер
+    while not done.wait(lease_seconds / 3):
+        if not queue.renew(task_id, worker_id, lease_seconds):
+            return
+
+
+def run_worker(queue_dir, worker_id, lease_seconds=LEASE_SECONDS, idle_sleep=IDLE_SLEEP, exit_when_idle=False):
+    queue = JobQueue(queue_dir)
+    print(f"[{worker_id}] слушаю очередь {queue.root}", flush=True)
+    while True:
+        task = queue.claim(worker_id, lease_seconds)
+        if task is None:
+            if exit_when_idle:
+                return
+            time.sleep(idle_sleep)
+            continue
+        settings = dict(task["settings"])
+        if settings.get("watermark_path"):
+            settings["watermark_path"] = str(queue.path(settings["watermark_path"]))
+        start_time = time.time()
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=_keep_lease, args=(queue, task["id"], worker_id, lease_seconds, done), daemon=True
+        )
+        heartbeat.start()
+        try:
+            process_file(str(queue.path(task["src"])), str(queue.path(task["dst"])), settings)
+            done.set()
+            heartbeat.join()
+            if queue.complete(task["id"], worker_id):
+                print(f"[{worker_id}] ✅ {task['rel']} ({time.time() - start_time:.2f} сек)", flush=True)
+            else:
+                # Задание отменено, пока шла обработка: результат никому не нужен
+                queue.discard_orphan(task)
+        except Exception as e:
+            done.set()
+            heartbeat.join()
+            # Нечитаемый файл не станет читаемым при повторе — такие ошибки не перезапускаем
+            queue.fail(task["id"], worker_id, str(e), task["attempts"], permanent=is_permanent_error(e))
+            print(f"[{worker_id}] ❌ {task['rel']}: {e}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhotoFlow: воркер очереди заданий")
+    parser.add_argument("--queue", default=os.environ.get("PHOTOFLOW_QUEUE_DIR"), help="Папка очереди (по умолчанию $PHOTOFLOW_QUEUE_DIR)")
+    parser.add_argument("--id", default=f"{socket.gethostname()}-{os.getpid()}", help="Имя воркера")
+    parser.add_argument("--processes", type=int, default=1, help="Сколько воркеров запустить на этой машине")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="Срок аренды задачи, сек")
+    parser.add_argument("--exit-when-idle", action="store_true", help="Завершиться, когда очередь пуста")
+    args = parser.parse_args(argv)
+    if not args.queue:
+        parser.error("укажите --queue или переменную PHOTOFLOW_QUEUE_DIR")
+    if args.processes <= 1:
+        run_worker(args.queue, args.id, args.lease, exit_when_idle=args.exit_when_idle)
+        return 0
+    procs = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(args.queue, f"{args.id}-{n}", args.lease),
+            kwargs={"exit_when_idle": args.exit_when_idle}
+        )
+        for n in range(args.processes)
+    ]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())